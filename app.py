@@ -1,67 +1,322 @@
 import streamlit as st
 import pandas as pd
+from collections import defaultdict
+import csv
 from datetime import datetime
+from functools import lru_cache
 import os
 
 # --- Constants ---
 EXPENSE_FILE = 'expenses.csv'
 DATE_FORMAT = '%Y-%m-%d'
+EXPENSE_COLUMNS = ['Date', 'Category', 'Amount', 'Description']
+# In-memory columns: the CSV columns plus the precomputed 'YYYY-MM' month
+EXPENSE_DF_COLUMNS = EXPENSE_COLUMNS + ['_month']
+# New expenses are written to EXPENSE_FILE in batches of this size, or sooner via "Save Now"
+PENDING_WRITE_LIMIT = 32
+# Example categories, you can make this dynamic or a text input
+CATEGORY_OPTIONS = ("Food", "Transport", "Shopping", "Entertainment", "Bills", "Health", "Other")
 
 # --- Helper Functions ---
-def load_expenses():
-    """Loads expenses from a CSV file. Creates an empty file if it doesn't exist."""
+def get_expense_file_mtime():
+    """Returns the expense file's modification time. Creates an empty file if it doesn't exist."""
     if not os.path.exists(EXPENSE_FILE):
         # Create an empty CSV with headers if it doesn't exist
-        df = pd.DataFrame(columns=['Date', 'Category', 'Amount', 'Description'])
+        df = pd.DataFrame(columns=EXPENSE_COLUMNS)
         df.to_csv(EXPENSE_FILE, index=False)
-        return []
+    return os.path.getmtime(EXPENSE_FILE)
+
+@st.cache_data(max_entries=1)
+def load_expenses(mtime):
+    """Loads expenses from a CSV file.
+
+    Returns a DataFrame of the valid expenses and a list of the invalid rows, which are kept so they can be reported.
+    `mtime` is only used as the cache key, so the file is re-read once it changes on disk.
+    Read errors are left to the caller, since Streamlit doesn't cache calls that raise.
+    """
+    # DictReader yields the rows as dictionaries directly; an empty file gives an empty list
+    with open(EXPENSE_FILE, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    valid_expenses = []
+    invalid_expenses = []
+    for row in rows:
+        if validate_expense(row)[0]:
+            valid_expenses.append(normalize_expense(row))
+        else:
+            invalid_expenses.append(row)
+    return build_expenses_df(valid_expenses), invalid_expenses
+
+def save_expenses(expenses_df):
+    """Saves an expenses DataFrame to a CSV file on the server (for app persistence).
+
+    Rewrites the whole file, so it is only needed when existing rows change. Use append_expenses() for new rows.
+    """
+    # Ensure correct column order and leave out in-memory only columns
+    df = expenses_df[EXPENSE_COLUMNS]
     try:
-        df = pd.read_csv(EXPENSE_FILE)
-        # Convert DataFrame rows to list of dictionaries
-        return df.to_dict(orient='records')
-    except pd.errors.EmptyDataError:
-        return [] # Return empty list if CSV is empty but exists
+        # A 1 MiB buffer keeps the number of write() calls low for large files
+        with open(EXPENSE_FILE, 'w', buffering=1 << 20, newline='', encoding='utf-8') as f:
+            df.to_csv(f, index=False)
     except Exception as e:
-        st.error(f"Error loading expenses: {e}")
-        return []
-
-def save_expenses(expenses):
-    """Saves expenses to a CSV file on the server (for app persistence)."""
-    if not expenses:
-        # If no expenses, create an empty DataFrame with headers
-        df = pd.DataFrame(columns=['Date', 'Category', 'Amount', 'Description'])
-    else:
-        df = pd.DataFrame(expenses)
-        # Ensure correct column order
-        df = df[['Date', 'Category', 'Amount', 'Description']]
+        st.error(f"Error saving expenses to server: {e}")
+
+def ends_with_newline(path):
+    """Checks whether a non-empty file ends with a line break."""
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) in (b'\n', b'\r')
+
+def append_expenses(expenses, sync=False):
+    """Appends expense rows to the CSV file on the server without rewriting existing rows.
+
+    With `sync`, the file is also fsync'ed so the rows are on disk before returning. Returns True on success.
+    """
     try:
-        df.to_csv(EXPENSE_FILE, index=False)
+        with open(EXPENSE_FILE, 'a', buffering=1 << 16, newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            # A missing or empty file still needs the header row
+            if f.tell() == 0:
+                writer.writerow(EXPENSE_COLUMNS)
+            elif not ends_with_newline(EXPENSE_FILE):
+                # Don't glue the first new row onto an unterminated last line
+                f.write('\n')
+            writer.writerows([expense.get(col, '') for col in EXPENSE_COLUMNS] for expense in expenses)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        return True
     except Exception as e:
         st.error(f"Error saving expenses to server: {e}")
+        return False
 
-def validate_expense(expense):
-    """Validates an expense entry."""
-    if not all(k in expense and expense[k] for k in ['Date', 'Category', 'Amount']):
-        return False, "Missing Date, Category, or Amount."
-    try:
-        # Attempt to convert amount to float
-        float(expense['Amount'])
-    except ValueError:
-        return False, "Amount must be a valid number."
+def flush_pending_writes(sync=False):
+    """Writes the expenses added since the last flush to the CSV file on the server."""
+    pending_writes = st.session_state.pending_writes
+    if pending_writes and append_expenses(pending_writes, sync=sync):
+        pending_writes.clear()
+
+def parse_date(value):
+    """Returns a date in zero-padded YYYY-MM-DD form, or None if it isn't a valid date.
+
+    Zero-padded dates take a fast path through datetime.fromisoformat, which is much cheaper than
+    datetime.strptime. Other values fall back to strptime, so unpadded dates such as 2026-1-2 are still accepted.
+    """
+    if not isinstance(value, str):
+        return None
     try:
-        # Attempt to parse date
-        datetime.strptime(expense['Date'], DATE_FORMAT)
+        if len(value) == 10 and value[4] == '-' and value[7] == '-':
+            datetime.fromisoformat(value)
+            return value
+        return datetime.strptime(value, DATE_FORMAT).strftime(DATE_FORMAT)
     except ValueError:
+        return None
+
+@lru_cache(maxsize=4096)
+def _validate_fields(date, category, amount):
+    """Validates the required fields of an expense. Results are memoized per distinct value tuple."""
+    if not (date and category and amount):
+        return False, "Missing Date, Category, or Amount."
+    # Normalized expenses already hold a float, so only strings need converting
+    if not isinstance(amount, float):
+        try:
+            float(amount)
+        except ValueError:
+            return False, "Amount must be a valid number."
+    if parse_date(date) is None:
         return False, "Date format should be YYYY-MM-DD."
     return True, ""
 
+def validate_expense(expense):
+    """Validates an expense entry."""
+    return _validate_fields(expense.get('Date'), expense.get('Category'), expense.get('Amount'))
+
+def normalize_expense(expense):
+    """Returns a copy of a valid expense with a zero-padded Date, Amount as a float and its 'YYYY-MM' month precomputed.
+
+    Padding the date keeps plain string sorting in date order.
+    """
+    date = parse_date(expense['Date'])
+    return {**expense, 'Date': date, 'Amount': float(expense['Amount']), '_month': date[:7]}
+
+def build_expenses_df(expenses):
+    """Builds the columnar DataFrame kept in session state from a list of normalized expenses."""
+    return pd.DataFrame(expenses, columns=EXPENSE_DF_COLUMNS).astype({'Amount': 'float64'})
+
+def build_monthly_totals(expenses_df):
+    """Sums expense amounts per 'YYYY-MM' month."""
+    # Group and sum in pandas rather than adding floats row by row
+    sums = expenses_df.groupby('_month')['Amount'].sum()
+    return defaultdict(float, sums.to_dict())
+
+def build_view_df(expenses_df):
+    """Builds the date-sorted DataFrame shown in View Expenses."""
+    # Sort by date. Dates are normalized to zero-padded YYYY-MM-DD strings, which sort correctly as plain text.
+    return expenses_df[EXPENSE_COLUMNS].sort_values(by='Date', ascending=False)
+
+def expenses_to_csv_bytes(expenses_df):
+    """Serializes an expenses DataFrame to UTF-8 CSV bytes for download."""
+    return expenses_df[EXPENSE_COLUMNS].to_csv(index=False).encode('utf-8')
+
+def get_derived(key, build):
+    """Returns build(expenses_df), rebuilding it only when the expenses have changed.
+
+    The result is kept in session state under `key` together with the expenses version it was built from.
+    """
+    version = st.session_state.expenses_version
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, build(st.session_state.expenses_df))
+        st.session_state[key] = cached
+    return cached[1]
+
+# --- Streamlit App Sections ---
+# Each section is a fragment, so interacting with its widgets only reruns that section.
+@st.fragment
+def add_expense_section():
+    """Renders the form for adding a new expense."""
+    st.header("Add New Expense")
+    with st.form("expense_form", clear_on_submit=True):
+        date = st.date_input("Date", datetime.today(), format="YYYY-MM-DD")
+        category = st.selectbox("Category", CATEGORY_OPTIONS)
+        amount = st.number_input("Amount", min_value=0.01, format="%.2f")
+        description = st.text_area("Description (Optional)")
+
+        submitted = st.form_submit_button("Add Expense")
+
+        if submitted:
+            new_expense = {
+                "Date": date.strftime(DATE_FORMAT),
+                "Category": category,
+                "Amount": amount,
+                "Description": description
+            }
+            is_valid, message = validate_expense(new_expense)
+            if is_valid:
+                new_expense = normalize_expense(new_expense)
+                expenses_df = st.session_state.expenses_df
+                expenses_df.loc[len(expenses_df)] = [new_expense[col] for col in EXPENSE_DF_COLUMNS]
+                st.session_state.expenses_version += 1
+                st.session_state.pending_writes.append(new_expense)
+                if len(st.session_state.pending_writes) >= PENDING_WRITE_LIMIT:
+                    flush_pending_writes()
+                st.session_state.monthly_totals[new_expense['_month']] += new_expense['Amount']
+                st.success("Expense added successfully!")
+                pending_count = len(st.session_state.pending_writes)
+                if pending_count:
+                    # Queued rows only live in this session until they are written out
+                    st.info(f"{pending_count} unsaved expense(s) — use Save Now in Save Data, or they are lost when this session ends.")
+            else:
+                st.error(f"Failed to add expense: {message}")
+
+@st.fragment
+def view_section():
+    """Renders the table of all valid expenses, newest first."""
+    st.header("View All Expenses")
+    expenses_df = st.session_state.expenses_df
+    if not expenses_df.empty or st.session_state.invalid_expenses:
+        # Invalid entries are skipped for display, but kept in session_state for now
+        for exp in st.session_state.invalid_expenses:
+            st.warning(f"Skipping incomplete or invalid entry: {exp}")
+
+        if not expenses_df.empty:
+            df_expenses = get_derived('view_df_cache', build_view_df)
+            st.dataframe(df_expenses, use_container_width=True)
+        else:
+            st.info("No valid expenses to display.")
+    else:
+        st.info("No expenses added yet. Add some in the 'Add Expense' section!")
+
+@st.fragment
+def budget_section():
+    """Renders the monthly budget input and the current month's spending against it."""
+    st.header("Monthly Budget Tracking")
+
+    # Input for monthly budget
+    current_budget = st.session_state.monthly_budget
+    new_budget = st.number_input("Set Monthly Budget", value=current_budget, min_value=0.0, format="%.2f")
+    if new_budget != current_budget:
+        st.session_state.monthly_budget = new_budget
+        st.success(f"Monthly budget set to £{st.session_state.monthly_budget:,.2f}")
+
+    # Look up total spending for the current month, kept up to date as expenses are added
+    current_month = datetime.now().strftime('%Y-%m') # e.g., '2025-07'
+    total_spending = st.session_state.monthly_totals.get(current_month, 0.0)
+
+    st.subheader(f"Current Month's Spending ({current_month})")
+    st.write(f"Total Spending: **£{total_spending:,.2f}**")
+    st.write(f"Monthly Budget: **£{st.session_state.monthly_budget:,.2f}**")
+
+    if st.session_state.monthly_budget > 0:
+        remaining_budget = st.session_state.monthly_budget - total_spending
+        budget_percentage = (total_spending / st.session_state.monthly_budget) * 100
+
+        st.progress(min(100, int(budget_percentage)), text=f"{int(budget_percentage)}% of budget used")
+
+        if remaining_budget >= 0:
+            st.success(f"Remaining Budget: **£{remaining_budget:,.2f}**")
+        else:
+            st.error(f"You are **£{-remaining_budget:,.2f}** over budget!")
+    elif total_spending > 0:
+        st.info("Set a monthly budget to track your spending against it.")
+    else:
+        st.info("No spending recorded for this month yet, or no budget set.")
+
+@st.fragment
+def save_section():
+    """Renders the server save controls and the CSV download of all valid expenses."""
+    st.header("Save Expense Data")
+
+    # Option 1: Save to the server's expense file
+    st.subheader("Save to Server")
+    st.write(f"New expenses are saved to the server automatically every {PENDING_WRITE_LIMIT} entries.")
+    # The callback runs before the rerun, so the count below already reflects the save
+    pending_count = len(st.session_state.pending_writes)
+    if pending_count:
+        st.info(f"Unsaved expenses: **{pending_count}**")
+    else:
+        st.success("All expenses are saved to the server.")
+    st.button("Save Now", on_click=flush_pending_writes, kwargs={'sync': True}, disabled=not pending_count)
+
+    # Option 2: Download to local machine (user chooses location)
+    st.subheader("Download to Your Computer")
+    st.write("Generate a CSV file of your expenses and download it to your local machine.")
+
+    # Get valid expenses for download. The CSV is built in memory only; this section never writes to disk.
+    expenses_df = st.session_state.expenses_df
+    if not expenses_df.empty:
+        # Only re-serialized after expenses change, not on filename edits or tab switches
+        csv_data = get_derived('csv_cache', expenses_to_csv_bytes)
+        download_filename = st.text_input("Enter desired filename (e.g., my_expenses.csv)", value="my_expenses.csv")
+
+        st.download_button(
+            label="Download Expenses CSV",
+            data=csv_data,
+            file_name=download_filename,
+            mime="text/csv",
+            on_click="ignore", # Downloading doesn't change any state, so skip the rerun
+            help="Click to download your expenses as a CSV file to your computer."
+        )
+    else:
+        st.info("No valid expenses to download yet.")
+
 # --- Streamlit App Layout ---
 def main():
     st.set_page_config(layout="wide", page_title="Personal Expense Tracker")
 
     # Initialize session state for expenses and budget if not already present
-    if 'expenses' not in st.session_state:
-        st.session_state.expenses = load_expenses()
+    if 'expenses_df' not in st.session_state:
+        try:
+            expenses_df, invalid_expenses = load_expenses(get_expense_file_mtime())
+        except Exception as e:
+            st.error(f"Error loading expenses: {e}")
+            expenses_df, invalid_expenses = build_expenses_df([]), []
+        st.session_state.expenses_df = expenses_df
+        st.session_state.invalid_expenses = invalid_expenses
+        st.session_state.monthly_totals = build_monthly_totals(expenses_df)
+        # Bumped whenever expenses_df changes, so derived objects know when to rebuild
+        st.session_state.expenses_version = 0
+    if 'pending_writes' not in st.session_state:
+        st.session_state.pending_writes = []
     if 'monthly_budget' not in st.session_state:
         st.session_state.monthly_budget = 0.0
 
@@ -74,131 +329,18 @@ def main():
         ("Add Expense", "View Expenses", "Track Budget", "Save Data")
     )
 
-    # --- Add Expense Section ---
     if menu_selection == "Add Expense":
-        st.header("Add New Expense")
-        with st.form("expense_form", clear_on_submit=True):
-            date = st.date_input("Date", datetime.today(), format="YYYY-MM-DD")
-            # Example categories, you can make this dynamic or a text input
-            category_options = ["Food", "Transport", "Shopping", "Entertainment", "Bills", "Health", "Other"]
-            category = st.selectbox("Category", category_options)
-            amount = st.number_input("Amount", min_value=0.01, format="%.2f")
-            description = st.text_area("Description (Optional)")
-
-            submitted = st.form_submit_button("Add Expense")
-
-            if submitted:
-                new_expense = {
-                    "Date": date.strftime(DATE_FORMAT),
-                    "Category": category,
-                    "Amount": amount,
-                    "Description": description
-                }
-                is_valid, message = validate_expense(new_expense)
-                if is_valid:
-                    st.session_state.expenses.append(new_expense)
-                    st.success("Expense added successfully!")
-                else:
-                    st.error(f"Failed to add expense: {message}")
-
-    # --- View Expenses Section ---
+        add_expense_section()
     elif menu_selection == "View Expenses":
-        st.header("View All Expenses")
-        if st.session_state.expenses:
-            # Filter out invalid entries for display, but keep them in session_state for now
-            valid_expenses_for_display = []
-            for exp in st.session_state.expenses:
-                is_valid, _ = validate_expense(exp)
-                if is_valid:
-                    valid_expenses_for_display.append(exp)
-                else:
-                    st.warning(f"Skipping incomplete or invalid entry: {exp}")
-
-            if valid_expenses_for_display:
-                df_expenses = pd.DataFrame(valid_expenses_for_display)
-                # Ensure 'Amount' is numeric for sorting/calculations
-                df_expenses['Amount'] = pd.to_numeric(df_expenses['Amount'], errors='coerce')
-                # Sort by date
-                df_expenses['Date'] = pd.to_datetime(df_expenses['Date'])
-                df_expenses = df_expenses.sort_values(by='Date', ascending=False)
-                df_expenses['Date'] = df_expenses['Date'].dt.strftime(DATE_FORMAT) # Convert back to string for display
-                st.dataframe(df_expenses, use_container_width=True)
-            else:
-                st.info("No valid expenses to display.")
-        else:
-            st.info("No expenses added yet. Add some in the 'Add Expense' section!")
-
-    # --- Track Budget Section ---
+        view_section()
     elif menu_selection == "Track Budget":
-        st.header("Monthly Budget Tracking")
-
-        # Input for monthly budget
-        current_budget = st.session_state.monthly_budget
-        new_budget = st.number_input("Set Monthly Budget", value=current_budget, min_value=0.0, format="%.2f")
-        if new_budget != current_budget:
-            st.session_state.monthly_budget = new_budget
-            st.success(f"Monthly budget set to £{st.session_state.monthly_budget:,.2f}")
-
-        # Calculate total spending for the current month
-        total_spending = 0.0
-        current_month = datetime.now().strftime('%Y-%m') # e.g., '2025-07'
-
-        for expense in st.session_state.expenses:
-            is_valid, _ = validate_expense(expense)
-            if is_valid and expense['Date'].startswith(current_month):
-                try:
-                    total_spending += float(expense['Amount'])
-                except ValueError:
-                    # This case should ideally be caught by validate_expense, but as a safeguard
-                    st.warning(f"Invalid amount found for an expense: {expense['Amount']}")
-
-        st.subheader(f"Current Month's Spending ({current_month})")
-        st.write(f"Total Spending: **£{total_spending:,.2f}**")
-        st.write(f"Monthly Budget: **£{st.session_state.monthly_budget:,.2f}**")
-
-        if st.session_state.monthly_budget > 0:
-            remaining_budget = st.session_state.monthly_budget - total_spending
-            budget_percentage = (total_spending / st.session_state.monthly_budget) * 100
-
-            st.progress(min(100, int(budget_percentage)), text=f"{int(budget_percentage)}% of budget used")
-
-            if remaining_budget >= 0:
-                st.success(f"Remaining Budget: **£{remaining_budget:,.2f}**")
-            else:
-                st.error(f"You are **£{-remaining_budget:,.2f}** over budget!")
-        elif total_spending > 0:
-            st.info("Set a monthly budget to track your spending against it.")
-        else:
-            st.info("No spending recorded for this month yet, or no budget set.")
-
-    # --- Save Data Section ---
+        budget_section()
     elif menu_selection == "Save Data":
-        st.header("Save Expense Data")
-
-        # Option 2: Download to local machine (user chooses location)
-        st.subheader("Download to Your Computer")
-        st.write("Generate a CSV file of your expenses and download it to your local machine.")
-
-        # Get valid expenses for download
-        valid_expenses_for_download = [exp for exp in st.session_state.expenses if validate_expense(exp)[0]]
-        if valid_expenses_for_download:
-            df_download = pd.DataFrame(valid_expenses_for_download)
-            csv_data = df_download.to_csv(index=False).encode('utf-8')
-            download_filename = st.text_input("Enter desired filename (e.g., my_expenses.csv)", value="my_expenses.csv")
-
-            st.download_button(
-                label="Download Expenses CSV",
-                data=csv_data,
-                file_name=download_filename,
-                mime="text/csv",
-                help="Click to download your expenses as a CSV file to your computer."
-            )
-        else:
-            st.info("No valid expenses to download yet.")
-
+        save_section()
 
     # --- Initial load message (Optional, for first run) ---
-    if not st.session_state.expenses and menu_selection != "Add Expense":
+    no_expenses = st.session_state.expenses_df.empty and not st.session_state.invalid_expenses
+    if no_expenses and menu_selection != "Add Expense":
         st.info("Welcome! Start by adding your expenses in the 'Add Expense' section.")
 
 if __name__ == "__main__":